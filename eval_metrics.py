@@ -1,5 +1,9 @@
 import argparse
+import multiprocessing.util
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
 import plotly.graph_objs
 import plotly.subplots
 
@@ -13,13 +17,16 @@ Usage:
 Arguments:
     -i: Path to the CSV file containing metrics (default: "metrics.csv").
     -o: Output folder for all plots (default: "plots").
+    --format: Output format, one of html, png, svg (default: png).
+    --workers: Number of parallel processes for plot generation (default: number of CPU cores).
 
 Installation:
-    pip install plotly
+    pip install plotly pandas
     pip install --upgrade kaleido
 
 Performance Tips:
-    - Use --format=html for fastest generation (no external rendering needed)
+    - Use --format=html for fastest generation (no external rendering needed). All plots
+      are written to a single index.html that loads plotly.js once from the CDN.
     - Use --format=png for raster images (slower, requires kaleido)
     - Parallel processing is automatic for multiple plots
     - Use --workers N to control parallelization (default: number of CPU cores)
@@ -27,22 +34,8 @@ Performance Tips:
 
 
 def get_metrics_from_csv(csv_path):
-    """Reads a CSV file and returns the metrics as a list of strings."""
-    with open(csv_path, "r") as f:
-        lines = f.readlines()
-
-    # Assuming the first line is the header and the other lines contain the metrics
-    header = lines[0].strip().split(",")
-    values = []
-    for line in lines[1:]:
-        values.append(line.strip().split(","))
-
-    # Transpose values to get columns
-    columns = list(zip(*values))
-
-    metrics = {}
-    for i, col in enumerate(columns):
-        metrics[header[i]] = list(col)
+    """Reads a CSV file and returns the metrics as a dict of numeric arrays."""
+    df = pd.read_csv(csv_path)
 
     # rename headers
     ## in_max_min_angle,in_avg_min_angle,in_min_max_angle,in_max_max_angle,in_avg_max_angle,in_min_ratio,in_max_ratio,in_avg_ratio,in_min_shape,in_max_shape,in_avg_shape,in_min_edge,in_max_edge,in_avg_edge,in_#F,in_#V,in_has_zero_area,in_has_zero_edge,in_runtime_seconds,out_min_min_angle,out_max_min_angle,out_avg_min_angle,out_min_max_angle,out_max_max_angle,out_avg_max_angle,out_min_ratio,out_max_ratio,out_avg_ratio,out_min_shape,out_max_shape,out_avg_shape,out_min_edge,out_max_edge,out_avg_edge,out_#F,out_#V,out_has_zero_area,out_has_zero_edge,out_hausdorff_distance,out_runtime_seconds,mesh_file
@@ -90,23 +83,19 @@ def get_metrics_from_csv(csv_path):
         "out_runtime_seconds": "Runtime remeshing (seconds)",
         "mesh_file": "",
     }
-    for old_name, new_name in rename_dict.items():
-        if old_name in metrics:
-            if new_name == "":
-                metrics.pop(old_name)
-            else:
-                metrics[new_name] = metrics.pop(old_name)
+    df = df.drop(columns=[c for c, n in rename_dict.items() if n == "" and c in df])
+    df = df.rename(columns=rename_dict)
 
-    return metrics
+    return {col: df[col].to_numpy() for col in df.columns}
 
 
 def create_metric_plot(metric_name, values, color):
     """Create a single metric histogram plot."""
+    # a typed array is serialized much faster by plotly than a list of floats
+    x = np.asarray(values, dtype=np.float32)
     fig = plotly.graph_objs.Figure()
     fig.add_trace(
-        plotly.graph_objs.Histogram(
-            x=list(map(float, values)), nbinsx=50, marker_color=color
-        ),
+        plotly.graph_objs.Histogram(x=x, nbinsx=50, histnorm=None, marker_color=color),
     )
 
     fig.update_layout(
@@ -127,6 +116,69 @@ def create_metric_plot(metric_name, values, color):
     return fig
 
 
+def start_image_export():
+    """Start a persistent kaleido browser that is reused by all write_image calls.
+
+    kaleido >= 1.0 otherwise launches a new browser for every image. Older
+    versions keep plotly.io.kaleido.scope alive on their own. Returns True if
+    a server was started and has to be stopped with stop_image_export().
+    """
+    try:
+        import kaleido
+    except ImportError:
+        return False
+
+    if not hasattr(kaleido, "start_sync_server"):
+        return False
+
+    kaleido.start_sync_server(silence_warnings=True)
+    return True
+
+
+def stop_image_export():
+    import kaleido
+
+    kaleido.stop_sync_server(silence_warnings=True)
+
+
+def init_worker():
+    """Start one kaleido browser per worker process and stop it when the worker exits."""
+    if start_image_export():
+        # atexit handlers do not run in pool workers, multiprocessing finalizers do
+        multiprocessing.util.Finalize(None, stop_image_export, exitpriority=10)
+
+
+def save_metric_plot(metric_name, values, color, image_format, output_folder):
+    """Create the histogram for one metric, write it as image to output_folder, and return the file path."""
+    fig = create_metric_plot(metric_name, values, color)
+
+    plot_file = os.path.join(output_folder, f"{metric_name}.{image_format}")
+    fig.write_image(plot_file, width=1000, height=600)
+    return plot_file
+
+
+def metric_plot_html(metric_name, values, color):
+    """Create the histogram for one metric as an HTML <div> without plotly.js."""
+    fig = create_metric_plot(metric_name, values, color)
+    return fig.to_html(full_html=False, include_plotlyjs=False, default_height=600)
+
+
+def write_html_page(html_file, divs):
+    """Write all plot <div>s into one page that loads plotly.js once from the CDN."""
+    plotlyjs_url = (
+        f"https://cdn.plot.ly/plotly-{plotly.offline.get_plotlyjs_version()}.min.js"
+    )
+    with open(html_file, "w") as f:
+        f.write("<html>\n<head>\n")
+        f.write('<meta charset="utf-8" />\n')
+        f.write(f'<script src="{plotlyjs_url}"></script>\n')
+        f.write("</head>\n<body>\n")
+        for div in divs:
+            f.write(div)
+            f.write("\n")
+        f.write("</body>\n</html>\n")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate and plot metrics from CSV.")
     parser.add_argument(
@@ -146,7 +198,13 @@ if __name__ == "__main__":
         type=str,
         default="png",
         choices=["html", "png", "svg"],
-        help="Output format: html (fastest), png/svg (slower, requires kaleido). Default: png",
+        help="Output format: html (fastest, single index.html), png/svg (slower, requires kaleido). Default: png",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of parallel processes for plot generation. Default: number of CPU cores",
     )
 
     args = parser.parse_args()
@@ -154,6 +212,7 @@ if __name__ == "__main__":
     csv_path = args.i
     output_folder = args.o
     image_format = args.format
+    num_workers = args.workers or os.cpu_count() or 1
 
     metrics = get_metrics_from_csv(csv_path)
 
@@ -179,20 +238,46 @@ if __name__ == "__main__":
     )
     os.makedirs(output_folder, exist_ok=True)
 
-    for i, (metric_name, values) in enumerate(metrics.items()):
-        color = set3_colors[i % len(set3_colors)]
-        fig = create_metric_plot(metric_name, values, color)
-
-        if image_format == "html":
-            plot_file = os.path.join(output_folder, f"{metric_name}.html")
-            fig.write_html(plot_file)
-        elif image_format == "png":
-            plot_file = os.path.join(output_folder, f"{metric_name}.png")
-            fig.write_image(plot_file, width=1000, height=600)
-        elif image_format == "svg":
-            plot_file = os.path.join(output_folder, f"{metric_name}.svg")
-            fig.write_image(plot_file, width=1000, height=600)
-
-        print(f"{i}: Saved {plot_file}")
+    # convert to float32 once here, workers only receive the numeric arrays
+    plot_args = [
+        (
+            metric_name,
+            np.asarray(values, dtype=np.float32),
+            set3_colors[i % len(set3_colors)],
+        )
+        for i, (metric_name, values) in enumerate(metrics.items())
+    ]
+    num_workers = min(num_workers, len(plot_args))
+    if num_workers > 1:
+        print(f"Using {num_workers} parallel workers.")
+
+    if image_format == "html":
+        if num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                divs = list(executor.map(metric_plot_html, *zip(*plot_args)))
+        else:
+            divs = [metric_plot_html(*a) for a in plot_args]
+        plot_file = os.path.join(output_folder, "index.html")
+        write_html_page(plot_file, divs)
+        print(f"Saved {len(divs)} plots to {plot_file}")
+    elif num_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=init_worker,
+        ) as executor:
+            futures = [
+                executor.submit(save_metric_plot, *a, image_format, output_folder)
+                for a in plot_args
+            ]
+            for i, future in enumerate(as_completed(futures)):
+                print(f"{i}: Saved {future.result()}")
+    else:
+        kaleido_server = start_image_export()
+        try:
+            for i, a in enumerate(plot_args):
+                print(f"{i}: Saved {save_metric_plot(*a, image_format, output_folder)}")
+        finally:
+            if kaleido_server:
+                stop_image_export()
 
     print(f"Plots saved to {output_folder}")
@@ -1,5 +1,3 @@
-import igl
-
 # from line_profiler import profile
 import numpy as np
 import meshio
@@ -8,7 +6,8 @@ import json
 import argparse
 import os
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 use_pymeme = True
 # try to import pymeme
@@ -42,15 +41,19 @@ Arguments:
     -o: output CSV file to save the metrics (default: mesh_quality_metrics.csv)
     -j: number of parallel jobs to use (default: 1)
     --extension: file extension of the mesh files (default: .vtu). Ignored if a single file is provided.
+    --cache: cache parsed meshes as <mesh_file>.npz to speed up repeated runs on the same files.
 
 For running on Greene Cluster:
     module load anaconda3/2024.02
     conda create -p ./penv python=3.10
     conda activate ./penv
     conda install pip
-    python3 -m pip install libigl
     pip install pandas meshio
 
+Installing numba (optional, speeds up the Python implementation):
+    pip install numba
+    python meshmetrics_kernels.py  # optional, compiles the kernel ahead of time
+
 Installing pymeme (optional):
     mkdir build
     cd build
@@ -83,61 +86,122 @@ def get_metric_names():
         ]
 
 
-metrics_names = get_metric_names()
-
-
 def law_of_cosines(a, b, c):
     x = (b**2 + c**2 - a**2) / (2 * b * c)
     x = np.clip(x, -1.0, 1.0)  # numerical stability
     return np.arccos(x) * (180.0 / np.pi)
 
 
-def compute_metrics_detailed(V, F):
-    if F.shape[0] == 0:
-        return []
+def triangle_metrics(V, F):
+    """Compute angles, radius ratios, and shape qualities for all triangles at once.
+
+    Triangles with a zero-length edge are skipped. Triangles with zero area
+    contribute their angles and a radius ratio of 0, but no shape quality.
+    """
+    # imported here, so the pymeme path neither imports numba nor compiles the kernel
+    from meshmetrics_kernels import use_numba, tri_metrics_kernel
+
+    if use_numba:
+        n = F.shape[0]
+        all_angles = np.empty(3 * n)
+        radius_ratios = np.empty(n)
+        shape_qualities = np.empty(n)
+        tri_metrics_kernel(
+            np.ascontiguousarray(V, dtype=np.float64),
+            np.ascontiguousarray(F, dtype=np.int64),
+            all_angles,
+            radius_ratios,
+            shape_qualities,
+        )
+        return (
+            all_angles[all_angles >= 0],
+            radius_ratios[radius_ratios >= 0],
+            shape_qualities[shape_qualities >= 0],
+        )
+
+    # gather each coordinate separately (structure of arrays), so all
+    # operations below run on contiguous 1D arrays
+    Vx, Vy, Vz = (np.ascontiguousarray(V[:, d]) for d in range(3))
+    F0, F1, F2 = F[:, 0], F[:, 1], F[:, 2]
+    x0, x1, x2 = Vx[F0], Vx[F1], Vx[F2]
+    y0, y1, y2 = Vy[F0], Vy[F1], Vy[F2]
+    z0, z1, z2 = Vz[F0], Vz[F1], Vz[F2]
+
+    # e0 = v1 - v2, e1 = v0 - v2, e2 = v0 - v1
+    e1x, e1y, e1z = x0 - x2, y0 - y2, z0 - z2
+    e2x, e2y, e2z = x0 - x1, y0 - y1, z0 - z1
+    a2 = (x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2
+    b2 = e1x * e1x + e1y * e1y + e1z * e1z
+    c2 = e2x * e2x + e2y * e2y + e2z * e2z
+
+    # squared norm of the cross product e1 x e2
+    n2 = (
+        (e1y * e2z - e1z * e2y) ** 2
+        + (e1z * e2x - e1x * e2z) ** 2
+        + (e1x * e2y - e1y * e2x) ** 2
+    )
 
-    all_angles = []
-    radius_ratios = []
-    shape_qualities = []
-    for face in F:
-        v0 = V[face[0]]
-        v1 = V[face[1]]
-        v2 = V[face[2]]
-        a = np.linalg.norm(v1 - v2)
-        b = np.linalg.norm(v0 - v2)
-        c = np.linalg.norm(v0 - v1)
-
-        # handle degenerate triangles
-        if a == 0 or b == 0 or c == 0:
-            # print("Degenerate triangle found:", face, "v0, v1, v2 =", v0, v1, v2)
-            continue
-
-        angles = [
-            law_of_cosines(a, b, c),
-            law_of_cosines(b, a, c),
-            law_of_cosines(c, a, b),
-        ]
-        all_angles.extend(angles)
+    # handle degenerate triangles
+    valid = (a2 > 0) & (b2 > 0) & (c2 > 0)
+    n2 = n2[valid]
+    a2 = a2[valid]
+    b2 = b2[valid]
+    c2 = c2[valid]
+    a = np.sqrt(a2)
+    b = np.sqrt(b2)
+    c = np.sqrt(c2)
+
+    k = a.shape[0]
+    all_angles = np.empty(3 * k)
+    all_angles[:k] = law_of_cosines(a, b, c)
+    all_angles[k : 2 * k] = law_of_cosines(b, a, c)
+    all_angles[2 * k :] = law_of_cosines(c, a, b)
+
+    area = 0.5 * np.sqrt(n2)
 
-        s = (a + b + c) / 2.0
-        area = np.sqrt(np.clip(s * (s - a) * (s - b) * (s - c), a_min=0, a_max=None))
+    # zero-area triangles get a radius ratio of 0 and no shape quality
+    nonzero = area > 0
+    area = area[nonzero]
+    a, b, c = a[nonzero], b[nonzero], c[nonzero]
 
-        if area == 0:
-            radius_ratios.append(0.0)
-            continue
+    s = (a + b + c) / 2.0
+    inradius = area / s
+    circumradius = (a * b * c) / (4.0 * area)
+    radius_ratios = np.zeros(nonzero.shape[0])
+    radius_ratios[nonzero] = 2.0 * inradius / circumradius
+    shape_qualities = (4.0 * np.sqrt(3) * area) / (a2 + b2 + c2)[nonzero]
 
-        inradius = area / s
-        circumradius = (a * b * c) / (4.0 * area)
-        radius_ratio = 2.0 * inradius / circumradius
-        radius_ratios.append(radius_ratio)
-        shape_quality = (4.0 * np.sqrt(3) * area) / (a**2 + b**2 + c**2)
-        shape_qualities.append(shape_quality)
+    return all_angles, radius_ratios, shape_qualities
 
-    all_angles = np.array(all_angles)
+
+def _edges_numpy(F):
+    """Unique undirected edges of F, equivalent to igl.edges(F) up to ordering.
+
+    Like igl.edges, faces with a repeated vertex do not contribute an edge (i, i).
+    """
+    E = np.concatenate([F[:, [0, 1]], F[:, [1, 2]], F[:, [2, 0]]])
+    E = E[E[:, 0] != E[:, 1]]
+    E.sort(axis=1)
+    # pack each edge into one int64 key, np.unique on 1D keys is much faster than on rows
+    key = E[:, 0].astype(np.int64) * (int(F.max()) + 1) + E[:, 1]
+    _, idx = np.unique(key, return_index=True)
+    return E[idx]
+
+
+def get_edges(F):
+    # older pymeme builds do not have edges()
+    if use_pymeme and hasattr(pymeme, "edges"):
+        return pymeme.edges(F)
+    return _edges_numpy(F)
+
+
+def compute_metrics_detailed(V, F):
+    if F.shape[0] == 0:
+        return []
+
+    all_angles, radius_ratios, shape_qualities = triangle_metrics(V, F)
     all_angles.sort()
-    radius_ratios = np.array(radius_ratios)
     radius_ratios.sort()
-    shape_qualities = np.array(shape_qualities)
     shape_qualities.sort()
 
     # get bounding box
@@ -146,7 +210,7 @@ def compute_metrics_detailed(V, F):
     bbox_size = bbox_max - bbox_min
     bbox_diag = np.linalg.norm(bbox_size)
     # get edges
-    edges = igl.edges(F)
+    edges = get_edges(F)
     edge_lengths = np.linalg.norm(V[edges[:, 0]] - V[edges[:, 1]], axis=1)
     edge_lengths.sort()
     edge_lengths /= bbox_diag  # normalize by bounding box diagonal
@@ -168,49 +232,39 @@ def compute_metrics_compact(V, F):
     if F.shape[0] == 0:
         return []
 
-    all_angles = []
-    radius_ratios = []
-    shape_qualities = []
-    for face in F:
-        v0 = V[face[0]]
-        v1 = V[face[1]]
-        v2 = V[face[2]]
-        a = np.linalg.norm(v1 - v2)
-        b = np.linalg.norm(v0 - v2)
-        c = np.linalg.norm(v0 - v1)
-
-        # handle degenerate triangles
-        if a == 0 or b == 0 or c == 0:
-            # print("Degenerate triangle found:", face, "v0, v1, v2 =", v0, v1, v2)
-            continue
-
-        angles = [
-            law_of_cosines(a, b, c),
-            law_of_cosines(b, a, c),
-            law_of_cosines(c, a, b),
+    # imported here for the same reason as in triangle_metrics
+    from meshmetrics_kernels import use_numba, tri_metrics_summary_kernel
+
+    if use_numba:
+        # one fused pass over all faces, no per-triangle arrays
+        summary = np.empty(11)
+        tri_metrics_summary_kernel(
+            np.ascontiguousarray(V, dtype=np.float64),
+            np.ascontiguousarray(F, dtype=np.int64),
+            summary,
+        )
+        n_valid = summary[9]
+        n_sq = summary[10]
+        # same as the min() of an empty array in the NumPy path
+        if n_valid == 0 or n_sq == 0:
+            raise ValueError("mesh has no non-degenerate triangles")
+        angle_metrics = [summary[0], summary[1], summary[2] / (3 * n_valid)]
+        radius_ratio_metrics = [summary[3], summary[4], summary[5] / n_valid]
+        shape_quality_metrics = [summary[6], summary[7], summary[8] / n_sq]
+    else:
+        # only min/max/mean are needed here, so no sorting
+        all_angles, radius_ratios, shape_qualities = triangle_metrics(V, F)
+        angle_metrics = [all_angles.min(), all_angles.max(), np.mean(all_angles)]
+        radius_ratio_metrics = [
+            radius_ratios.min(),
+            radius_ratios.max(),
+            np.mean(radius_ratios),
+        ]
+        shape_quality_metrics = [
+            shape_qualities.min(),
+            shape_qualities.max(),
+            np.mean(shape_qualities),
         ]
-        all_angles.extend(angles)
-
-        s = (a + b + c) / 2.0
-        area = np.sqrt(np.clip(s * (s - a) * (s - b) * (s - c), a_min=0, a_max=None))
-
-        if area == 0:
-            radius_ratios.append(0.0)
-            continue
-
-        inradius = area / s
-        circumradius = (a * b * c) / (4.0 * area)
-        radius_ratio = 2.0 * inradius / circumradius
-        radius_ratios.append(radius_ratio)
-        shape_quality = (4.0 * np.sqrt(3) * area) / (a**2 + b**2 + c**2)
-        shape_qualities.append(shape_quality)
-
-    all_angles = np.array(all_angles)
-    all_angles.sort()
-    radius_ratios = np.array(radius_ratios)
-    radius_ratios.sort()
-    shape_qualities = np.array(shape_qualities)
-    shape_qualities.sort()
 
     # get bounding box
     bbox_min = np.min(V, axis=0)
@@ -218,23 +272,16 @@ def compute_metrics_compact(V, F):
     bbox_size = bbox_max - bbox_min
     bbox_diag = np.linalg.norm(bbox_size)
     # get edges
-    edges = igl.edges(F)
+    edges = get_edges(F)
     edge_lengths = np.linalg.norm(V[edges[:, 0]] - V[edges[:, 1]], axis=1)
-    edge_lengths.sort()
     edge_lengths /= bbox_diag  # normalize by bounding box diagonal
 
     metrics = [
-        all_angles[0],
-        all_angles[-1],
-        np.mean(all_angles),
-        radius_ratios[0],
-        radius_ratios[-1],
-        np.mean(radius_ratios),
-        shape_qualities[0],
-        shape_qualities[-1],
-        np.mean(shape_qualities),
-        edge_lengths[0],
-        edge_lengths[-1],
+        *angle_metrics,
+        *radius_ratio_metrics,
+        *shape_quality_metrics,
+        edge_lengths.min(),
+        edge_lengths.max(),
         np.mean(edge_lengths),
         F.shape[0],
         V.shape[0],
@@ -243,21 +290,46 @@ def compute_metrics_compact(V, F):
     return metrics
 
 
-def load_mesh(mesh_path):
-    mesh = meshio.read(mesh_path)
+def load_mesh(mesh_path, use_cache=False):
+    """Load vertices and triangles of a mesh.
+
+    With use_cache, the parsed (V, F) are stored next to the mesh as
+    <mesh_path>.npz and reused as long as the mesh file is not newer.
+    """
+    cache_path = mesh_path + ".npz"
+    if (
+        use_cache
+        and os.path.exists(cache_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(mesh_path)
+    ):
+        with np.load(cache_path) as data:
+            return data["V"], data["F"]
+
+    # skip meshio's format detection for the common case
+    if mesh_path.endswith(".vtu"):
+        mesh = meshio.vtu.read(mesh_path)
+    else:
+        mesh = meshio.read(mesh_path)
 
     if "triangle" not in mesh.cells_dict:
         V = np.zeros((0, 3))
         F = np.zeros((0, 3), dtype=int)
-        return V, F
+    else:
+        V = mesh.points
+        F = mesh.cells_dict["triangle"]
+
+    if use_cache:
+        # write to a temporary file first so parallel jobs never read a partial cache
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, V=V, F=F)
+        os.replace(tmp_path, cache_path)
 
-    V = mesh.points
-    F = mesh.cells_dict["triangle"]
     return V, F
 
 
-def mesh_metrics_compact(mesh_path):
-    V, F = load_mesh(mesh_path)
+def mesh_metrics_compact(mesh_path, use_cache=False):
+    V, F = load_mesh(mesh_path, use_cache)
     if F.shape[0] == 0:
         return []
     if F.shape[1] != 3:
@@ -269,11 +341,34 @@ def mesh_metrics_compact(mesh_path):
         return compute_metrics_compact(V, F)
 
 
-def mesh_metrics_detailed(mesh_path):
-    V, F = load_mesh(mesh_path)
+def mesh_metrics_detailed(mesh_path, use_cache=False):
+    V, F = load_mesh(mesh_path, use_cache)
     return compute_metrics_detailed(V, F)
 
 
+def mesh_metrics_safe(mesh_path, use_cache=False):
+    """Like mesh_metrics_compact but returns (metrics, error) instead of raising.
+
+    Used with executor.map, which would otherwise stop at the first failing mesh.
+    """
+    try:
+        return mesh_metrics_compact(mesh_path, use_cache), None
+    except Exception as exc:
+        return None, str(exc)
+
+
+def init_worker():
+    """Prepare the Numba kernel in each worker before the first mesh arrives.
+
+    The pool already runs one process per job, so the kernel runs on one
+    thread per worker. The warm-up call compiles it or loads it from the cache.
+    """
+    if not use_pymeme:
+        # read by numba when it is imported, on the first use of the kernel
+        os.environ["NUMBA_NUM_THREADS"] = "1"
+        triangle_metrics(np.eye(3), np.array([[0, 1, 2]]))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Compute mesh quality metrics for one or multiple triangular meshes stored as .vtu files."
@@ -307,24 +402,33 @@ if __name__ == "__main__":
         required=False,
         help="Number of parallel jobs to use.",
     )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache parsed meshes as <mesh_file>.npz next to the mesh files.",
+    )
     args = parser.parse_args()
 
     path = args.i
     output_csv = args.o
     num_jobs = args.j
     extension = args.extension
+    use_cache = args.cache
 
     # record runtime
     start_time = time.time()
 
+    # only needed in the main process, workers return plain metric lists
+    metrics_names = get_metric_names()
+
     if os.path.isfile(path):
         print(f"Evaluating mesh: {path}")
 
-        metrics = mesh_metrics_compact(path)
+        metrics = mesh_metrics_compact(path, use_cache)
         for name, value in zip(metrics_names, metrics):
             print(f"{name}: {value}")
 
-        metrics = mesh_metrics_detailed(path)
+        metrics = mesh_metrics_detailed(path, use_cache)
         output_json = output_csv.replace(".csv", ".json")
         with open(output_json, "w") as f:
             json.dump(metrics, f, indent=4)
@@ -345,17 +449,20 @@ if __name__ == "__main__":
 
         if num_jobs > 1:
             print(f"Using {num_jobs} parallel jobs.")
-            with ProcessPoolExecutor(max_workers=num_jobs) as executor:
-                future_to_mesh = {
-                    executor.submit(mesh_metrics_compact, mesh_file): mesh_file
-                    for mesh_file in mesh_files
-                }
-                for future in as_completed(future_to_mesh):
-                    mesh_file = future_to_mesh[future]
-                    try:
-                        metrics = future.result()
-                    except Exception as exc:  # keep failures visible
-                        print(f"Failed on {mesh_file}: {exc}")
+            # send meshes in chunks to avoid paying the dispatch overhead for every single mesh
+            chunksize = max(1, len(mesh_files) // (num_jobs * 8))
+            with ProcessPoolExecutor(
+                max_workers=num_jobs, initializer=init_worker
+            ) as executor:
+                results = executor.map(
+                    mesh_metrics_safe,
+                    mesh_files,
+                    repeat(use_cache),
+                    chunksize=chunksize,
+                )
+                for mesh_file, (metrics, error) in zip(mesh_files, results):
+                    if error is not None:  # keep failures visible
+                        print(f"Failed on {mesh_file}: {error}")
                         continue
                     if not metrics:
                         continue
@@ -366,7 +473,7 @@ if __name__ == "__main__":
             print("Using single thread.")
             for mesh_file in mesh_files:
                 try:
-                    metrics = mesh_metrics_compact(mesh_file)
+                    metrics = mesh_metrics_compact(mesh_file, use_cache)
                 except Exception as exc:
                     print(f"Failed on {mesh_file}: {exc}")
                     continue
@@ -1,6 +1,5 @@
 import random
 import sys
-import igl
 
 # from line_profiler import profile
 import numpy as np
@@ -12,7 +11,9 @@ import os
 import time
 import traceback
 import pickle
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 use_pymeme = True
 import pymeme
@@ -40,6 +41,11 @@ Get mesh quality metrics for triangular meshes stored as .vtu files.
 Input: path to a .vtu file or a folder with .vtu files
 Output: CSV file with mesh quality metrics for each mesh. It can be stored as .csv or .zip to save disk space.
 
+Per-triangle output: metrics_per_tri_in.npy and metrics_per_tri_out.npy hold one uint8
+row per triangle. metrics_per_tri.pkl holds the metric names, the scale factors, and
+under "in"/"out" the paths of the two .npy files relative to the pickle. Older versions
+stored the arrays themselves under "in"/"out". Use load_metrics_per_tri() to read them.
+
 Example usage:
     python get_metrics.py -i path/to/mesh_or_folder -o output_metrics.csv -j 4
 
@@ -48,13 +54,13 @@ Arguments:
     -o: output CSV file to save the metrics (default: mesh_quality_metrics.csv)
     -j: number of parallel jobs to use (default: 1)
     --extension: file extension of the mesh files (default: .vtu). Ignored if a single file is provided.
+    --cache: cache parsed meshes as <mesh_file>.npz to speed up repeated runs on the same files.
 
 For running on Greene Cluster:
     module load anaconda3/2024.02
     conda create -p ./penv python=3.10
     conda activate ./penv
     conda install pip
-    pip install -v 'libigl==2.5.1'
     pip install pandas meshio
 
 Installing pymeme:
@@ -73,23 +79,126 @@ def get_metric_names():
     return names
 
 
-metrics_names = get_metric_names()
+# All per-triangle metrics are bounded (angles in [0, 180], ratio and shape in
+# [0, 1]) and are stored as uint8. Divide by these factors to get the values back.
+metric_scales = {"min_angle": 1.0, "max_angle": 1.0, "ratio": 255.0, "shape": 255.0}
+
+
+def get_scale_factors(names):
+    """Scale factors for the given per-triangle metric names, see metric_scales."""
+    unknown = [name for name in names if name not in metric_scales]
+    if unknown:
+        raise ValueError(
+            f"No uint8 scale factor for per-triangle metrics {unknown}, add them to metric_scales."
+        )
+    return np.array([metric_scales[name] for name in names])
+
+
+def quantize_metrics(metrics, scale_factors):
+    return np.rint(metrics * scale_factors).clip(0, 255).astype(np.uint8)
+
+
+class NpyRowWriter:
+    """Append rows to a .npy file on disk instead of collecting them in memory.
 
+    The header has a fixed size and is rewritten with the final row count on
+    close(), so the result can be read with np.load(path, mmap_mode="r").
+    """
 
-def load_mesh(mesh_path):
-    mesh = meshio.read(mesh_path)
+    header_size = 128
+
+    def __init__(self, path, n_cols, dtype):
+        self.path = path
+        self.n_cols = n_cols
+        self.dtype = np.dtype(dtype)
+        self.n_rows = 0
+        self.file = open(path, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        header = repr(
+            {
+                "descr": np.lib.format.dtype_to_descr(self.dtype),
+                "fortran_order": False,
+                "shape": (self.n_rows, self.n_cols),
+            }
+        ).encode("latin1")
+        magic = np.lib.format.magic(1, 0)
+        header_len = self.header_size - len(magic) - 2
+        header = header.ljust(header_len - 1) + b"\n"
+        self.file.seek(0)
+        self.file.write(magic + struct.pack("<H", header_len) + header)
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        self.file.write(rows.tobytes())
+        self.n_rows += rows.shape[0]
+
+    def close(self):
+        self._write_header()
+        self.file.close()
+
+
+def load_metrics_per_tri(pickle_path="metrics_per_tri.pkl", mmap_mode="r"):
+    """Load the results written by this script as (metadata, metrics_in, metrics_out).
+
+    The .npy paths in the pickle are resolved relative to its directory.
+    """
+    with open(pickle_path, "rb") as f:
+        metadata = pickle.load(f)
+    folder = os.path.dirname(os.path.abspath(pickle_path))
+    metrics_in = np.load(os.path.join(folder, metadata["in"]), mmap_mode=mmap_mode)
+    metrics_out = np.load(os.path.join(folder, metadata["out"]), mmap_mode=mmap_mode)
+    return metadata, metrics_in, metrics_out
+
+
+def load_mesh(mesh_path, use_cache=False):
+    """Load vertices and triangles of a mesh.
+
+    With use_cache, the parsed (V, F) are stored next to the mesh as
+    <mesh_path>.npz and reused as long as the mesh file is not newer.
+    """
+    cache_path = mesh_path + ".npz"
+    if (
+        use_cache
+        and os.path.exists(cache_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(mesh_path)
+    ):
+        with np.load(cache_path) as data:
+            return data["V"], data["F"]
+
+    # skip meshio's format detection for the common case
+    if mesh_path.endswith(".vtu"):
+        mesh = meshio.vtu.read(mesh_path)
+    else:
+        mesh = meshio.read(mesh_path)
 
     if "triangle" not in mesh.cells_dict:
         V = np.zeros((0, 3))
         F = np.zeros((0, 3), dtype=int)
-        return V, F
+    else:
+        V = mesh.points
+        F = mesh.cells_dict["triangle"]
+
+    if use_cache:
+        # write to a temporary file first so parallel jobs never read a partial cache
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, V=V, F=F)
+        os.replace(tmp_path, cache_path)
 
-    V = mesh.points
-    F = mesh.cells_dict["triangle"]
     return V, F
 
 
-def mesh_metrics_per_tri(results_path, mesh_id):
+def mesh_metrics_per_tri(results_path, mesh_id, use_cache=False, scale_factors=None):
+    """Per-triangle metrics of the input and remeshed mesh of mesh_id as uint8.
+
+    scale_factors defaults to get_scale_factors(get_metric_names()). Pass it
+    in to avoid querying pymeme for every mesh.
+    """
+    if scale_factors is None:
+        scale_factors = get_scale_factors(get_metric_names())
+
     out_mesh_path = os.path.join(results_path, mesh_id, "remeshed.vtu")
     in_mesh_path = os.path.join(results_path, mesh_id, "mesh.obj")
 
@@ -99,17 +208,33 @@ def mesh_metrics_per_tri(results_path, mesh_id):
         )
 
     # metrics for input mesh
-    V_in, F_in = load_mesh(in_mesh_path)
+    V_in, F_in = load_mesh(in_mesh_path, use_cache)
     metrics_in = pymeme.get_metrics_per_tri(V_in, F_in)
-    metrics_in = metrics_in.astype(np.float16)
+    metrics_in = quantize_metrics(metrics_in, scale_factors)
 
     # metrics for remeshed mesh
-    V_out, F_out = load_mesh(out_mesh_path)
+    V_out, F_out = load_mesh(out_mesh_path, use_cache)
     metrics_out = pymeme.get_metrics_per_tri(V_out, F_out)
-    metrics_out = metrics_out.astype(np.float16)
+    metrics_out = quantize_metrics(metrics_out, scale_factors)
     return metrics_in, metrics_out
 
 
+def mesh_metrics_per_tri_safe(
+    results_path, mesh_id, use_cache=False, scale_factors=None
+):
+    """Like mesh_metrics_per_tri but returns (metrics_in, metrics_out, error) instead of raising.
+
+    Used with executor.map, which would otherwise stop at the first failing mesh.
+    """
+    try:
+        return (
+            *mesh_metrics_per_tri(results_path, mesh_id, use_cache, scale_factors),
+            None,
+        )
+    except Exception as exc:
+        return None, None, str(exc)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Compute mesh quality metrics for one or multiple triangular meshes stored as .vtu files."
@@ -129,13 +254,23 @@ if __name__ == "__main__":
         required=False,
         help="Number of parallel jobs to use.",
     )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache parsed meshes as <mesh_file>.npz next to the mesh files.",
+    )
     args = parser.parse_args()
 
     results_path = args.i
     num_jobs = args.j
+    use_cache = args.cache
     # record runtime
     start_time = time.time()
 
+    # only queried in the main process, workers receive the scale factors
+    metrics_names = get_metric_names()
+    scale_factors = get_scale_factors(metrics_names)
+
     # find all folders in path
     mesh_ids = [
         d
@@ -154,82 +289,99 @@ if __name__ == "__main__":
     else:
         print(f"Evaluating runtimes on all {len(mesh_ids)} meshes...")
 
-    all_results_in = []
-    all_results_out = []
-
     if len(mesh_ids) == 0:
         print("No meshes to process. Exiting.")
         exit(0)
 
     non_empty_mesh_files = 0
 
+    # per-triangle results are streamed to .npy files, the pickle only holds the metadata
     output_pickle = "metrics_per_tri.pkl"
-
-    if num_jobs > 1:
-        print(f"Using {num_jobs} parallel jobs.")
-        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
-            future_to_mesh = {
-                executor.submit(
-                    mesh_metrics_per_tri,
-                    results_path,
-                    mesh_id,
-                ): mesh_id
-                for mesh_id in mesh_ids
-            }
-            for future in as_completed(future_to_mesh):
-                mesh_id = future_to_mesh[future]
+    output_in = "metrics_per_tri_in.npy"
+    output_out = "metrics_per_tri_out.npy"
+    writer_in = NpyRowWriter(output_in, len(metrics_names), np.uint8)
+    writer_out = NpyRowWriter(output_out, len(metrics_names), np.uint8)
+
+    # close in any case, so the headers match the rows written so far
+    try:
+        if num_jobs > 1:
+            print(f"Using {num_jobs} parallel jobs.")
+            # send meshes in chunks to avoid paying the dispatch overhead for every single mesh
+            chunksize = max(1, len(mesh_ids) // (num_jobs * 8))
+            with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+                results = executor.map(
+                    mesh_metrics_per_tri_safe,
+                    repeat(results_path),
+                    mesh_ids,
+                    repeat(use_cache),
+                    repeat(scale_factors),
+                    chunksize=chunksize,
+                )
+                for mesh_id, (metrics_in, metrics_out, error) in zip(mesh_ids, results):
+                    if error is not None:  # keep failures visible
+                        print(f"Failed on {mesh_id}: {error}")
+                        continue
+                    non_empty_mesh_files += 1
+                    writer_in.append(metrics_in)
+                    writer_out.append(metrics_out)
+                    print(
+                        f"{non_empty_mesh_files}/{len(mesh_ids)} Processed mesh: {mesh_id}"
+                    )
+                    sys.stdout.flush()
+        else:
+            print("Using single thread.")
+            for mesh_id in mesh_ids:
                 try:
-                    metrics_in, metrics_out = future.result()
-                except Exception as exc:  # keep failures visible
+                    metrics_in, metrics_out = mesh_metrics_per_tri(
+                        results_path, mesh_id, use_cache, scale_factors
+                    )
+                except Exception as exc:
                     print(f"Failed on {mesh_id}: {exc}")
+                    # traceback.print_exc()
                     continue
                 non_empty_mesh_files += 1
-                all_results_in.append(metrics_in)
-                all_results_out.append(metrics_out)
+                writer_in.append(metrics_in)
+                writer_out.append(metrics_out)
                 print(
                     f"{non_empty_mesh_files}/{len(mesh_ids)} Processed mesh: {mesh_id}"
                 )
                 sys.stdout.flush()
-    else:
-        print("Using single thread.")
-        for mesh_id in mesh_ids:
-            try:
-                metrics_in, metrics_out = mesh_metrics_per_tri(results_path, mesh_id)
-            except Exception as exc:
-                print(f"Failed on {mesh_id}: {exc}")
-                # traceback.print_exc()
-                continue
-            non_empty_mesh_files += 1
-            all_results_in.append(metrics_in)
-            all_results_out.append(metrics_out)
-            print(f"{non_empty_mesh_files}/{len(mesh_ids)} Processed mesh: {mesh_id}")
-            sys.stdout.flush()
+    finally:
+        writer_in.close()
+        writer_out.close()
 
     print(f"Evaluated {non_empty_mesh_files} non-empty mesh files.")
 
-    # Convert lists to numpy arrays
-    if all_results_in:
-        all_results_in = np.vstack(all_results_in)
-        all_results_out = np.vstack(all_results_out)
-
-        df_in = pd.DataFrame(all_results_in, columns=metrics_names)
-        print(df_in.head())  # print first 5 rows of dataframe
+    if non_empty_mesh_files > 0:
+        df_in = pd.DataFrame(
+            np.load(output_in, mmap_mode="r")[:5], columns=metrics_names
+        )
+        print(df_in)  # print first 5 rows
 
-        df_out = pd.DataFrame(all_results_out, columns=metrics_names)
-        print(df_out.head())  # print first 5 rows of dataframe
+        df_out = pd.DataFrame(
+            np.load(output_out, mmap_mode="r")[:5], columns=metrics_names
+        )
+        print(df_out)  # print first 5 rows
 
-        # Store both arrays in a single pickle file
+        # paths are relative to the pickle, see load_metrics_per_tri()
+        pickle_folder = os.path.dirname(os.path.abspath(output_pickle))
         with open(output_pickle, "wb") as f:
             pickle.dump(
                 {
                     "names": metrics_names,
-                    "in": all_results_in,
-                    "out": all_results_out,
+                    "scale_factors": scale_factors,
+                    "in": os.path.relpath(output_in, pickle_folder),
+                    "out": os.path.relpath(output_out, pickle_folder),
                 },
                 f,
             )
 
-        print(f"Saved results to {output_pickle}")
+        print(f"Saved results to {output_pickle}, {output_in}, and {output_out}")
+    else:
+        # no results, also remove a pickle of an earlier run that would point to these files
+        for path in (output_in, output_out, output_pickle):
+            if os.path.exists(path):
+                os.remove(path)
 
     stop_time = time.time()
     print(f"Total runtime: {stop_time - start_time:.2f} seconds")
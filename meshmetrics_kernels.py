@@ -0,0 +1,198 @@
+"""
+Numba kernels for get_metrics.py.
+
+The kernels are compiled for a fixed signature on import and cached on disk. Running
+
+    python meshmetrics_kernels.py
+
+compiles them ahead of time into the extension module meshmetrics_kernels_aot,
+which is then imported instead. This removes the compilation stall in every
+new process but gives up the multi-threaded prange loop. numba.pycc is pending
+deprecation since Numba 0.57 (it warns on import), so the AOT build is optional.
+
+numba is only imported to compile the kernels, so loading the AOT module does
+not import it.
+"""
+
+import math
+import os
+
+
+def triangle_at(V, F, i):
+    """Metrics of face i as (valid, angle0, angle1, angle2, radius_ratio, shape_quality).
+
+    valid is False for triangles with a zero-length edge. Zero-area triangles
+    have a radius ratio of 0 and a shape quality of -1.
+    """
+    v0 = F[i, 0]
+    v1 = F[i, 1]
+    v2 = F[i, 2]
+    # e0 = v1 - v2, e1 = v0 - v2, e2 = v0 - v1
+    e0x = V[v1, 0] - V[v2, 0]
+    e0y = V[v1, 1] - V[v2, 1]
+    e0z = V[v1, 2] - V[v2, 2]
+    e1x = V[v0, 0] - V[v2, 0]
+    e1y = V[v0, 1] - V[v2, 1]
+    e1z = V[v0, 2] - V[v2, 2]
+    e2x = V[v0, 0] - V[v1, 0]
+    e2y = V[v0, 1] - V[v1, 1]
+    e2z = V[v0, 2] - V[v1, 2]
+    a2 = e0x * e0x + e0y * e0y + e0z * e0z
+    b2 = e1x * e1x + e1y * e1y + e1z * e1z
+    c2 = e2x * e2x + e2y * e2y + e2z * e2z
+
+    # handle degenerate triangles
+    if a2 == 0 or b2 == 0 or c2 == 0:
+        return False, 0.0, 0.0, 0.0, 0.0, 0.0
+
+    a = math.sqrt(a2)
+    b = math.sqrt(b2)
+    c = math.sqrt(c2)
+
+    # law of cosines, clamped for numerical stability
+    x = min(max((b2 + c2 - a2) / (2.0 * b * c), -1.0), 1.0)
+    angle0 = math.acos(x) * (180.0 / math.pi)
+    x = min(max((a2 + c2 - b2) / (2.0 * a * c), -1.0), 1.0)
+    angle1 = math.acos(x) * (180.0 / math.pi)
+    x = min(max((a2 + b2 - c2) / (2.0 * a * b), -1.0), 1.0)
+    angle2 = math.acos(x) * (180.0 / math.pi)
+
+    # area from the cross product e1 x e2
+    nx = e1y * e2z - e1z * e2y
+    ny = e1z * e2x - e1x * e2z
+    nz = e1x * e2y - e1y * e2x
+    area = 0.5 * math.sqrt(nx * nx + ny * ny + nz * nz)
+
+    if area == 0:
+        return True, angle0, angle1, angle2, 0.0, -1.0
+
+    s = (a + b + c) / 2.0
+    inradius = area / s
+    circumradius = (a * b * c) / (4.0 * area)
+    radius_ratio = 2.0 * inradius / circumradius
+    shape_quality = (4.0 * math.sqrt(3.0) * area) / (a2 + b2 + c2)
+    return True, angle0, angle1, angle2, radius_ratio, shape_quality
+
+
+def compute_tri_metrics(V, F, angles_out, rr_out, sq_out):
+    """Per-triangle kernel writing into preallocated arrays.
+
+    angles_out has 3 entries per face, rr_out and sq_out one each. Entries
+    that are skipped (see get_metrics.triangle_metrics) are set to -1.
+    """
+    for i in prange(F.shape[0]):
+        valid, angle0, angle1, angle2, rr, sq = _triangle_at_jit(V, F, i)
+        if not valid:
+            angles_out[3 * i] = -1.0
+            angles_out[3 * i + 1] = -1.0
+            angles_out[3 * i + 2] = -1.0
+            rr_out[i] = -1.0
+            sq_out[i] = -1.0
+            continue
+        angles_out[3 * i] = angle0
+        angles_out[3 * i + 1] = angle1
+        angles_out[3 * i + 2] = angle2
+        rr_out[i] = rr
+        sq_out[i] = sq
+
+
+def compute_tri_metrics_summary(V, F, out):
+    """Fused kernel computing only the min/max/sum of all per-triangle metrics.
+
+    Each face is read once and no per-triangle arrays are written. out has
+    11 entries: min/max/sum of the angles (0-2), radius ratios (3-5), and
+    shape qualities (6-8), the number of non-degenerate faces (9), and the
+    number of faces with a shape quality (10).
+    """
+    # finite sentinels just outside the value ranges (angles in [0, 180], ratio and
+    # shape in [0, 1]), fastmath assumes that no value is infinite
+    angle_min = 181.0
+    angle_max = -1.0
+    angle_sum = 0.0
+    rr_min = 2.0
+    rr_max = -1.0
+    rr_sum = 0.0
+    sq_min = 2.0
+    sq_max = -1.0
+    sq_sum = 0.0
+    n_valid = 0
+    n_sq = 0
+    for i in prange(F.shape[0]):
+        valid, angle0, angle1, angle2, rr, sq = _triangle_at_jit(V, F, i)
+        if not valid:
+            continue
+        angle_min = min(angle_min, min(angle0, min(angle1, angle2)))
+        angle_max = max(angle_max, max(angle0, max(angle1, angle2)))
+        angle_sum += angle0 + angle1 + angle2
+        rr_min = min(rr_min, rr)
+        rr_max = max(rr_max, rr)
+        rr_sum += rr
+        n_valid += 1
+        if sq >= 0:
+            sq_min = min(sq_min, sq)
+            sq_max = max(sq_max, sq)
+            sq_sum += sq
+            n_sq += 1
+
+    out[0] = angle_min
+    out[1] = angle_max
+    out[2] = angle_sum
+    out[3] = rr_min
+    out[4] = rr_max
+    out[5] = rr_sum
+    out[6] = sq_min
+    out[7] = sq_max
+    out[8] = sq_sum
+    out[9] = n_valid
+    out[10] = n_sq
+
+
+# Explicit C-contiguous signature: the kernel is compiled when this module is
+# imported (not on the first call) and LLVM knows the memory layout.
+# F is int64 because that is what meshio returns, so no conversion copy is needed.
+tri_metrics_signature = "void(f8[:,::1], i8[:,::1], f8[::1], f8[::1], f8[::1])"
+tri_metrics_summary_signature = "void(f8[:,::1], i8[:,::1], f8[::1])"
+
+
+if __name__ == "__main__":
+    # pycc compiles the prange loops as serial loops
+    from numba import njit, prange
+    from numba.pycc import CC
+
+    _triangle_at_jit = njit(fastmath=True)(triangle_at)
+    cc = CC("meshmetrics_kernels_aot")
+    cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+    cc.export("compute_tri_metrics", tri_metrics_signature)(compute_tri_metrics)
+    cc.export("compute_tri_metrics_summary", tri_metrics_summary_signature)(
+        compute_tri_metrics_summary
+    )
+    cc.compile()
+    print(f"Compiled meshmetrics_kernels_aot to {cc.output_dir}")
+else:
+    try:
+        from meshmetrics_kernels_aot import (
+            compute_tri_metrics as tri_metrics_kernel,
+            compute_tri_metrics_summary as tri_metrics_summary_kernel,
+        )
+
+        use_numba = True
+    except ImportError:
+        try:
+            # prange and _triangle_at_jit are looked up when the kernels are compiled
+            from numba import njit, prange
+
+            use_numba = True
+        except ImportError:
+            use_numba = False
+
+        if use_numba:
+            _triangle_at_jit = njit(fastmath=True, cache=True)(triangle_at)
+            tri_metrics_kernel = njit(
+                tri_metrics_signature, parallel=True, fastmath=True, cache=True
+            )(compute_tri_metrics)
+            tri_metrics_summary_kernel = njit(
+                tri_metrics_summary_signature, parallel=True, fastmath=True, cache=True
+            )(compute_tri_metrics_summary)
+        else:
+            tri_metrics_kernel = None
+            tri_metrics_summary_kernel = None
@@ -1,6 +1,11 @@
 #include "meme.hpp"
 
 #include <igl/edges.h>
+#include <algorithm>
+#include <stdexcept>
+#include <string>
+#include <utility>
+#include <vector>
 
 namespace meme {
 
@@ -242,6 +247,38 @@ VectorXd get_relative_edge_lengths(const MatrixXd& V, const MatrixXi& F)
     return lengths;
 }
 
+MatrixXi get_edges(const MatrixXi& F)
+{
+    if (F.cols() != 3) {
+        throw std::invalid_argument(
+            "F has not the expected number of cols. F.cols() = " + std::to_string(F.cols()));
+    }
+
+    // Not igl::edges: it sizes E from the adjacency matrix including its diagonal, so faces with
+    // a repeated vertex leave uninitialized rows in E. Edges (i, i) are skipped here.
+    std::vector<std::pair<int, int>> edges;
+    edges.reserve(3 * F.rows());
+    for (size_t i = 0; i < F.rows(); ++i) {
+        for (size_t j = 0; j < 3; ++j) {
+            const int a = F(i, j);
+            const int b = F(i, (j + 1) % 3);
+            if (a != b) {
+                edges.emplace_back(std::min(a, b), std::max(a, b));
+            }
+        }
+    }
+    std::sort(edges.begin(), edges.end());
+    edges.erase(std::unique(edges.begin(), edges.end()), edges.end());
+
+    MatrixXi E;
+    E.resize(edges.size(), 2);
+    for (size_t i = 0; i < edges.size(); ++i) {
+        E(i, 0) = edges[i].first;
+        E(i, 1) = edges[i].second;
+    }
+    return E;
+}
+
 std::array<std::string, 19> get_metrics_names()
 {
     return std::array<std::string, 19>{
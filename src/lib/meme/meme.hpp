@@ -17,6 +17,8 @@ MatrixXd get_metrics_per_tri(const MatrixXd& V, const MatrixXi& F);
 
 VectorXd get_relative_edge_lengths(const MatrixXd& V, const MatrixXi& F);
 
+MatrixXi get_edges(const MatrixXi& F);
+
 std::array<std::string, 19> get_metrics_names();
 
 std::array<std::string, 4> get_metrics_names_per_tri();
@@ -21,4 +21,5 @@ PYBIND11_MODULE(pymeme, m, py::mod_gil_not_used())
         "get_relative_edge_lenghts",
         &meme::get_relative_edge_lengths,
         "Get edge lengths realtive to bbox diagonal");
+    m.def("edges", &meme::get_edges, "Get unique undirected edges of a triangle mesh");
 }
\ No newline at end of file